@@ -12,7 +12,7 @@ import logging
 from collections import defaultdict
 
 # import things from other scripts
-from inventory import setup_logger, load_json
+from inventory import setup_logger, find_inventory_files, load_json_files
 
 
 
@@ -28,35 +28,20 @@ class PathNoGood(Exception):
 
 
 
-def process_one_dir(path, directory_summary):
+def process_one_dir(path, contents, directory_summary):
     """
-    Return inventory contents for the given path, if there is an inventory file.
+    Return inventory contents for the given path, given the contents of its inventory file.
     """
 
     logger.info("Process path: %s" % path)
 
-    contents = []
-    invpath = os.path.join(path,args.inventory_file_name)
-    try:
-        if os.path.exists(invpath) and os.path.isfile(invpath):
-            contents = load_json(invpath)
-            for idx in range(len(contents)):
-                name,*more = contents[idx]         # not concerned about what the inventory says about the file, except the first element should be the name
-                name = os.path.join(path,name)     # enhance the file paths with the directory
-                contents[idx] = name,*more
-            delete_dir_tracking[path]['total'] = len(contents)
-            directory_summary['count'] += 1
-            directory_summary['inventories'].append(path)
-    except OSError as err:
-        logger.warning("Failed to read an inventory file.")
-        logger.debug(err,exc_info=True)
-        directory_summary['errors'] += 1
-
-    if args.recursive:
-        for thing in os.listdir(path):
-            thing = os.path.join(path, thing)
-            if os.path.isdir(thing):
-                contents += process_one_dir(thing, directory_summary)
+    for idx in range(len(contents)):
+        name,*more = contents[idx]         # not concerned about what the inventory says about the file, except the first element should be the name
+        name = os.path.join(path,name)     # enhance the file paths with the directory
+        contents[idx] = name,*more
+    delete_dir_tracking[path]['total'] = len(contents)
+    directory_summary['count'] += 1
+    directory_summary['inventories'].append(path)
 
     return contents
 
@@ -172,10 +157,20 @@ def main():
                 logger.error("The program can not continue.")
                 exit(-1)
 
+        found = []
+        for d in args.directories:
+            find_inventory_files(d, args.inventory_file_name, recursive=args.recursive, found=found)
+
+        # the files are read in the background, but processed in order
         directory_summary = {'count': 0, 'inventories': [], 'errors': 0}
         merged_inventory = []
-        for d in args.directories:
-            merged_inventory += process_one_dir(d, directory_summary)
+        for (path,_),contents in zip(found, load_json_files([invpath for _,invpath in found])):
+            if isinstance(contents, OSError):
+                logger.warning("Failed to read an inventory file.")
+                logger.debug(contents,exc_info=contents)
+                directory_summary['errors'] += 1
+                continue
+            merged_inventory += process_one_dir(path, contents, directory_summary)
         logger.info("Found %d inventory files containing %d records." % (directory_summary['count'],len(merged_inventory)))
         logger.info("Encountered %d errors loading inventories." % directory_summary['errors'])
 
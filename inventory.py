@@ -9,14 +9,18 @@ import sys
 import shutil
 import datetime
 import json, re
+import struct
 import logging
 from logging.handlers import RotatingFileHandler
 import argparse, glob
 from collections import defaultdict
-from multiprocessing import cpu_count
+from multiprocessing import cpu_count, Pool as ProcessPool
 from multiprocessing.dummy import Pool as ThreadPool
 import PIL.Image as Image
-import piexif
+try:
+    import orjson    # optional, a faster JSON implementation
+except ImportError:
+    orjson = None
 
 
 
@@ -25,11 +29,18 @@ logger = None
 args = None
 filter_summary = {'rejected': defaultdict(lambda: 0), 'passed': defaultdict(lambda: 0)}
 all_inventories = dict()
+process_pool = None       # pool of worker processes shared by all directories, when requested
 current_year = datetime.datetime.now().year
 
 all_media_files = ('.jpg','.jpeg','.png','.tif','.tiff','.gif','.mp4','.mov','.avi','.wmv','.mpg','.cr2','.mp3')
 checkable_image_files = ('.jpg','.jpeg','.png')
 
+# ex: b'2005-06-27T09:56:05-04:00'
+# ex: b'2006:05:22 19:17:28\x00'
+date_regex = re.compile(rb"^(\d\d\d\d)[:-](\d\d)[:-](\d\d)[T ](\d\d):(\d\d):(\d\d)Z?(?:\000|[+-]\d\d:\d\d)?$")    # the timezone is not used
+dim_regex = re.compile(r"^(\d+)x(\d+)$")
+noncompliant_regex = re.compile(u"[^\t\n\r\x20-\x7e\u00c6\u00e6\u00d8\u00f8\u00c5\u00e5\u00d6\u00f6\u00dc\u00fc]")    # see cleanse_bytes(), the complement of what it keeps
+
 
 
 def setup_logger(name, path=None, file_level=logging.DEBUG, console_level=logging.WARN, num_old_logs=2, use_pid=False, use_log_subdir=True, log_threadids=False, rotate_mbytes=None, log_time_to_console=False):
@@ -196,18 +207,21 @@ def file_lister(in_path, file_list, recursive=False, join_func=os.path.join, ign
     max_files:         only return the given number of files
     """
 
-    for a_file in os.listdir(in_path):
-        if max_files and len(file_list) >= max_files:
-            break
-        if (ignore_files and a_file in ignore_files) or (prefix and not a_file.startswith(prefix)):
-            logger.debug("In file_lister(): ignoring path: '%s'." % a_file)
-            continue
-        full_file = join_func(in_path, a_file)
-        if os.path.isdir(full_file):
-            if recursive:
-                file_lister(full_file, file_list, recursive=True, ignore_files=ignore_files, filter_func=filter_func, prefix="", max_files=max_files)
-        elif ((not filter_func) or filter_func(a_file)) and ((not filter_func_full) or filter_func_full(full_file)):
-            file_list.append(full_file)
+    # the directory entries usually know their type, saving a stat() per file
+    with os.scandir(in_path) as entries:
+        for entry in entries:
+            if max_files and len(file_list) >= max_files:
+                break
+            a_file = entry.name
+            if (ignore_files and a_file in ignore_files) or (prefix and not a_file.startswith(prefix)):
+                logger.debug("In file_lister(): ignoring path: '%s'." % a_file)
+                continue
+            full_file = entry.path if join_func is os.path.join else join_func(in_path, a_file)    # the entry has already joined it the same way
+            if entry.is_dir():
+                if recursive:
+                    file_lister(full_file, file_list, recursive=True, ignore_files=ignore_files, filter_func=filter_func, prefix="", max_files=max_files)
+            elif ((not filter_func) or filter_func(a_file)) and ((not filter_func_full) or filter_func_full(full_file)):
+                file_list.append(full_file)
 
 
 
@@ -239,18 +253,14 @@ def parse_date_str(datestr):
     if is_unicode(datestr):
         datestr = datestr.encode('ascii')
 
-    # ex: b'2005-06-27T09:56:05-04:00'
-    # ex: b'2006:05:22 19:17:28\x00'
-    m = re.match(rb"^(\d\d\d\d)[:-](\d\d)[:-](\d\d)[T ](\d\d):(\d\d):(\d\d)Z?(\000|[+-]\d\d:\d\d)?$",datestr)
+    m = date_regex.match(datestr)
     if not m:
         logger.warning("Failed to parse: %s" % datestr)
         return None
 
-    res = tuple(int(m.group(x+1)) for x in range(6))
-    bounds = ((1998,current_year), (1,12), (1,31), (0,24), (0,59), (0,59))    # anything before the year 1998 is considered obviously incorrect
-    for idx in range(6):
-        if res[idx] < bounds[idx][0] or res[idx] > bounds[idx][1]:
-            return None   # ignore obviously incorrect dates
+    res = (int(m[1]), int(m[2]), int(m[3]), int(m[4]), int(m[5]), int(m[6]))
+    if not (1998 <= res[0] <= current_year and 1 <= res[1] <= 12 and 1 <= res[2] <= 31 and 0 <= res[3] <= 24 and 0 <= res[4] <= 59 and 0 <= res[5] <= 59):
+        return None   # ignore obviously incorrect dates (anything before the year 1998 is considered obviously incorrect)
 
     return res
 
@@ -272,7 +282,7 @@ def parse_dim_str(dimstr):
     if not dimstr:
         return None
 
-    m = re.match(r"^(\d+)x(\d+)$",dimstr)
+    m = dim_regex.match(dimstr)
     if not m:
         raise ValueError("Unable to parse dimentions string.")
     return int(m.group(1)), int(m.group(2))
@@ -383,6 +393,98 @@ def make_file_id(path, calculate_checksums=True):
 
 
 
+jpeg_sof_markers = frozenset((0xc0,0xc1,0xc2,0xc3,0xc5,0xc6,0xc7,0xc9,0xca,0xcb,0xcd,0xce,0xcf))
+exif_date_tags = ((0, 0x0132), (0x8769, 0x9003), (0x8769, 0x9004))    # (IFD pointer tag or 0 for IFD0, tag) for DateTime, DateTimeOriginal, DateTimeDigitized
+
+
+
+def read_exif_dates(tiff):
+    """
+    Return a dict mapping (IFD,tag) from exif_date_tags to the raw bytes of those dates found in the given TIFF-format EXIF data.
+    """
+
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if not endian:
+        raise ValueError("Unknown TIFF byte order.")
+
+    found = dict()
+    wanted = set(tag for _,tag in exif_date_tags)
+    ifds = [(0, struct.unpack(endian+'I', tiff[4:8])[0])]
+    while ifds:
+        ifd, offset = ifds.pop()
+        count = struct.unpack(endian+'H', tiff[offset:offset+2])[0]
+        for entry in range(offset+2, offset+2+12*count, 12):
+            tag, typ, num = struct.unpack(endian+'HHI', tiff[entry:entry+8])
+            if ifd == 0 and tag == 0x8769:
+                ifds.append((tag, struct.unpack(endian+'I', tiff[entry+8:entry+12])[0]))
+            elif tag in wanted and typ == 2:
+                if num <= 4:
+                    val = tiff[entry+8:entry+8+num]
+                else:
+                    val_offset = struct.unpack(endian+'I', tiff[entry+8:entry+12])[0]
+                    val = tiff[val_offset:val_offset+num]
+                found[(ifd,tag)] = val.rstrip(b'\000')
+    return found
+
+
+
+def read_exif_date(tiff):
+    """
+    Return the first date in the given TIFF-format EXIF data that makes sense (DateTime, DateTimeOriginal, then DateTimeDigitized) as str, or None.
+    """
+
+    found = read_exif_dates(tiff)
+    for key in exif_date_tags:
+        dt = parse_date_str(found.get(key))
+        if dt:
+            return format_date_tuple(dt)
+    return None
+
+
+
+def read_jpeg_info(path):
+    """
+    Walk the segments at the start of a JPEG file to find the EXIF dates and the frame size, without PIL.
+
+    Return (date as str, dims as str) like obtain_image_info(), raise ValueError for anything out of the ordinary.
+    """
+
+    exif = None
+    with open(path, 'rb', buffering=65536) as fh:    # the headers (including an EXIF thumbnail) usually fit, so usually a single read() call
+        if fh.read(2) != b'\xff\xd8':
+            raise ValueError("No JPEG start of image marker.")
+        while True:
+            hdr = fh.read(4)
+            if len(hdr) != 4 or hdr[0] != 0xff:
+                raise ValueError("Bad JPEG segment header.")
+            marker = hdr[1]
+            length = struct.unpack('>H', hdr[2:4])[0]
+            if marker == 0xda or length < 2:
+                raise ValueError("Did not find the JPEG frame header.")
+            if marker == 0xe1 and exif is None:
+                seg = fh.read(length-2)
+                if seg.startswith(b'Exif\000\000'):
+                    exif = seg[6:]
+            elif marker in jpeg_sof_markers:
+                seg = fh.read(5)
+                if len(seg) != 5:
+                    raise ValueError("Short JPEG frame header.")
+                hig, wid = struct.unpack('>HH', seg[1:5])
+                break
+            else:
+                fh.seek(length-2, os.SEEK_CUR)
+
+    if exif:
+        dt = read_exif_date(exif)
+    else:
+        logger.debug("Did not find exif data: %s" % path)
+        dt = None
+
+    sz = format_dim_tuple((wid,hig)) if wid and hig else None
+    return dt,sz
+
+
+
 def obtain_image_info(path):
     """
     For jpg and png files, open them to check for validity, to look for exif dates, and to determine dimentions.
@@ -390,26 +492,23 @@ def obtain_image_info(path):
     Return (date as str, dims as str), one or both of which can be None.
     """
 
+    if path.lower().endswith(('.jpg','.jpeg')):
+        try:
+            return read_jpeg_info(path)
+        except (ValueError, IndexError, struct.error) as err:
+            logger.debug("Fast JPEG header read failed, will use PIL: %s (%s)" % (path,err))
+
     with Image.open(path) as imgobj:
         if 'exif' in imgobj.info:
+            tiff = imgobj.info['exif']
+            if tiff.startswith(b'Exif\000\000'):
+                tiff = tiff[6:]
             try:
-                exif_dict = piexif.load(imgobj.info['exif'])
-            except Exception as err:
+                dt = read_exif_date(tiff)
+            except (ValueError, IndexError, struct.error) as err:
                 logger.warning("Failed to read exif: %s" % path)
                 logger.debug(err, exc_info=True)
                 dt = None
-            else:
-                try:
-                    # the piexif lib gives us what it can find in the exif data
-                    dt = parse_date_str(exif_dict["0th"].get(piexif.ImageIFD.DateTime))
-                    dt = dt or parse_date_str(exif_dict["Exif"].get(piexif.ExifIFD.DateTimeOriginal))
-                    dt = dt or parse_date_str(exif_dict["Exif"].get(piexif.ExifIFD.DateTimeDigitized))
-                    dt = dt or None
-                    if dt:
-                        dt = format_date_tuple(dt)
-                except KeyError:
-                    logger.warning("Failed to read exif (missing key): %s" % path)
-                    dt = None
         else:
             logger.debug("Did not find exif data: %s" % path)
             dt = None
@@ -421,7 +520,54 @@ def obtain_image_info(path):
 
 
 
-def directory_inventory(directory, remove_directory=None, recursive=True, ignore_files=None, filter_func=None, calculate_checksums=True, escape_non_ascii=True, parallel=True):
+def inventory_name(a_file, remove_directory, escape_non_ascii):
+    """
+    Return the name of a file as it is stored in an inventory.
+    """
+
+    if remove_directory:
+        if a_file.startswith(remove_directory):
+            a_file = a_file[len(remove_directory):]
+            a_file = a_file.lstrip(os.path.sep)   # if part of the path is removed, what remains can not start with the directory separator
+        else:
+            raise Exception("Unable to remove directory from path.")
+
+    if running_on_windows():
+        a_file = a_file.replace("\\","/")       # we need to standardize the path separator so it works between platforms
+    return cleanse_bytes(a_file, non_compliance_long_notation=escape_non_ascii)
+
+
+
+def inventory_one_file(idx, count, a_file, name, calculate_checksums, known=None):
+    """
+    Produce the inventory entry [name,size,checksum[,date,dims]] for one file, or None if that fails.  Runs in a worker thread or process.
+
+    known:  when specified, an existing inventory entry for the file, its date and dims are reused if the size and checksum still match
+    """
+
+    try:
+        logger.debug(u"ID file %s of %s: '%s'" % (idx+1,count,cleanse_bytes(a_file)))
+        size,checksum = make_file_id(a_file, calculate_checksums)
+
+        # get image properties for certain file types
+        _, ext = os.path.splitext(a_file.lower())
+        more = []
+        if ext in checkable_image_files:
+            if calculate_checksums and known and len(known) == 5 and known[1] == size and known[2] == checksum:
+                more = list(known[3:])    # same content as before, so the same answer as before
+            else:
+                dt,dim = obtain_image_info(a_file)
+                if dt or dim:
+                    more = [dt, dim]
+
+        return [name, size, checksum] + more
+    except Exception as err:
+        logger.error("Exception " + str(type(err)) + " while examining a file.", exc_info=True)
+        return None
+
+
+
+def directory_inventory(directory, remove_directory=None, recursive=True, ignore_files=None, filter_func=None, calculate_checksums=True, escape_non_ascii=True, parallel=True, pool=None, known_inventory=None):
     """
     Produce a list of tuples (name,size,checksum[,date,dims]) for the files in the given directory.  Name is native unicode.
 
@@ -432,6 +578,9 @@ def directory_inventory(directory, remove_directory=None, recursive=True, ignore
     filter_func:          when specified, must return a True-ey value for any acceptable file name to be included (path is not included)
     calculate_checksums:  when True-ey, calculate a checksum for each file, by default sha256, with "crc32" and "md5" as valid alternatives
     escape_non_ascii:     when True-ey, replace various characters in the filenames with a (0xFF) notation, note does not escape existing (0xFF) in filenames
+    parallel:             when True-ey, examine several files at once using a pool of threads
+    pool:                 when specified, an existing (process) pool to examine the files with instead, it is not closed here
+    known_inventory:      when specified, an existing inventory of the directory, image dates and dims in it are reused for files that have not changed
     """
 
     # remove all directory components except the last
@@ -443,49 +592,23 @@ def directory_inventory(directory, remove_directory=None, recursive=True, ignore
 
     files = list()
     file_lister(directory, files, recursive=recursive, ignore_files=ignore_files, filter_func=filter_func)
-    if len(files) > 1 and cpu_count() > 1 and parallel:
-        pool = ThreadPool(min(4,cpu_count()))   # generally python does best with a small number of threads
-    else:
-        pool = None
-
-    inventory_items = list()
+    known_items = dict((bits[0],bits) for bits in known_inventory or [])
+    jobs = []
     for idx,a_file in enumerate(files):
-        def worker(idx,a_file):
-            try:
-                logger.debug(u"ID file %s of %s: '%s'" % (idx+1,len(files),cleanse_bytes(a_file)))
-                size,checksum = make_file_id(a_file, calculate_checksums)
-
-                # get image properties for certain file types
-                _, ext = os.path.splitext(a_file.lower())
-                more = []
-                if ext in checkable_image_files:
-                    dt,dim = obtain_image_info(a_file)
-                    if dt or dim:
-                        more = [dt, dim]
-
-                if remove_directory:
-                    if a_file.startswith(remove_directory):
-                        a_file = a_file[len(remove_directory):]
-                        a_file = a_file.lstrip(os.path.sep)   # if part of the path is removed, what remains can not start with the directory separator
-                    else:
-                        raise Exception("Unable to remove directory from path.")
-
-                if running_on_windows():
-                    a_file = a_file.replace("\\","/")       # we need to standardize the path separator so it works between platforms
-                a_file = cleanse_bytes(a_file, non_compliance_long_notation=escape_non_ascii)
-
-                inventory_items.append([a_file, size, checksum] + more)
-            except Exception as err:
-                logger.error("Exception " + str(type(err)) + " while examining a file.", exc_info=True)
-        if pool:
-            pool.apply_async(worker, (idx,a_file))
-        else:
-            worker(idx,a_file)
-
-    if pool:
+        name = inventory_name(a_file, remove_directory, escape_non_ascii)
+        jobs.append((idx, len(files), a_file, name, calculate_checksums, known_items.get(name)))
+    if pool and len(files) > 1:
+        # hand the files out in batches, since each one is a round trip to another process
+        results = pool.starmap(inventory_one_file, jobs, chunksize=max(1, min(32, len(jobs) // (4*cpu_count()))))
+    elif len(files) > 1 and cpu_count() > 1 and parallel:
+        pool = ThreadPool(min(4,cpu_count()))   # generally python does best with a small number of threads
+        results = pool.starmap(inventory_one_file, jobs)
         pool.close()
         pool.join()
+    else:
+        results = [inventory_one_file(*job) for job in jobs]
 
+    inventory_items = [x for x in results if x is not None]
     if len(inventory_items) != len(files):
         raise Exception("It seems that not all worker jobs suceeded (%s vs %s)." % (len(inventory_items),len(files)))
 
@@ -747,6 +870,14 @@ def cleanse_bytes(some_object, non_compliance_long_notation=False, output_encodi
         elif sys.version_info >= (3,0,0):  joiner = b""; noncompliant = b"(0x%02X)"
         else:                              joiner =  ""; noncompliant =  "(0x%02X)"
 
+        if str_is_unicode:
+            # let the regex engine find the few characters to replace, rather than looking at each character here
+            if non_compliance_long_notation:
+                res, replaced = noncompliant_regex.subn(lambda m: noncompliant % ord(m.group()), input_string)
+            else:
+                res, replaced = noncompliant_regex.subn(chr(0xFFFD) if sys.version_info >= (3,0,0) else unichr(0xFFFD), input_string)  # pylint: disable=undefined-variable
+            return res, len(input_string) - replaced
+
         score = 0
         res = [c for c in input_string]
         for idx,c in enumerate(input_string):
@@ -845,6 +976,8 @@ def load_json(json_file):
 
     text = read_utf8_file(json_file)
     try:
+        if orjson:
+            return orjson.loads(text)
         return json.loads(text)
     except Exception:
         logger.info("Got %d unicode characters." % len(text))
@@ -859,9 +992,80 @@ def write_json(out_path, some_object):
     If your object contains keys or values which are encoded non-ASCII bytes already, it is likely that you will get an encoding error.
     """
 
-    with open(out_path,'wb') as fh:
+    data = None
+    if orjson:
+        try:
+            data = b'\xef\xbb\xbf' + orjson.dumps(some_object, option=orjson.OPT_INDENT_2)   # same output as json.dumps() below
+        except TypeError:
+            logger.debug("The orjson module could not encode the object, will use the json module.")
+    if data is None:
         txt = json.dumps(some_object, indent=2, ensure_ascii=False)    # indent: formatted JSON so people can read it
-        fh.write(txt.encode('utf-8-sig'))
+        data = txt.encode('utf-8-sig')
+    with open(out_path,'wb') as fh:
+        fh.write(data)
+
+
+
+def find_inventory_files(path, inventory_file_name, recursive=False, found=None, threads=8):
+    """
+    Return a list of (directory, inventory file path) for the directories at (and optionally below) the given path which have an inventory file, parents before children.
+
+    Each level of the tree is examined by several threads at once, since listing directories is mostly waiting for the disk.
+    """
+
+    def worker(d):
+        has_inventory = os.path.isfile(os.path.join(d, inventory_file_name))
+        subdirs = []
+        if recursive:
+            with os.scandir(d) as entries:
+                subdirs = [entry.path for entry in entries if entry.is_dir()]    # the entries usually know their type, saving a stat() each
+        return has_inventory, subdirs
+
+    # look at the tree one level at a time
+    scanned = dict()
+    level = [path]
+    pool = ThreadPool(threads)
+    try:
+        while level:
+            results = pool.map(worker, level)
+            scanned.update(zip(level, results))
+            level = [subdir for _,subdirs in results for subdir in subdirs]
+    finally:
+        pool.close()
+
+    # then put the directories in walk order
+    if found is None:
+        found = list()
+    pending = [path]    # explicit stack rather than recursion, so deep trees do not hit the recursion limit
+    while pending:
+        path = pending.pop()
+        has_inventory, subdirs = scanned[path]
+        if has_inventory:
+            found.append((path, os.path.join(path, inventory_file_name)))
+        pending.extend(reversed(subdirs))    # reversed, so they come off the stack in listing order
+    return found
+
+
+
+def load_json_files(paths, threads=4):
+    """
+    Yield the object loaded from each of the given JSON files, in order, or the OSError if a file could not be read.
+
+    Several files are read at once, since reading is mostly waiting (and the parsing itself is mostly C code).
+    """
+
+    def worker(path):
+        try:
+            return load_json(path)
+        except OSError as err:
+            return err
+
+    pool = ThreadPool(threads)
+    try:
+        for result in pool.imap(worker, paths):
+            yield result
+    finally:
+        pool.close()
 
 
 
@@ -1007,16 +1211,28 @@ def process_one_directory(d):
         logger.info("Process: %s" % d)
 
         invpath = os.path.join(d,args.inventory_file_name)
-        if os.path.exists(invpath) and args.create_only:
+        have_inventory = os.path.exists(invpath)
+        if have_inventory and args.create_only:
             return True, "skipped"
         
+        # load the existing inventory first, image dates and dims in it can be reused for files that have not changed
+        old_inventory = None
+        load_error = None
+        if have_inventory and not args.replace_inventory_files:
+            try:
+                old_inventory = load_json(invpath)
+            except ValueError as err:
+                load_error = err
+
         inventory = directory_inventory(
             d,
             remove_directory = True,
             recursive        = False,
             filter_func      = our_filter_func,
             escape_non_ascii = False,
-            parallel         = (not args.single_thread)
+            parallel         = (not args.single_thread),
+            pool             = process_pool,
+            known_inventory  = (None if args.reread_image_info else old_inventory)
         )
         all_inventories[d] = inventory
 
@@ -1030,13 +1246,11 @@ def process_one_directory(d):
             logger.info("Spent %s on %s of files (%0.01f MB/sec)." % (etstr,szstr,(size/(1024.0*1024.0*et))))
 
         revised_inventory = False
-        if os.path.exists(invpath) and not args.replace_inventory_files:
+        if have_inventory and not args.replace_inventory_files:
             logger.info("An inventory file exists.")
-            try:
-                old_inventory = load_json(invpath)
-            except ValueError as err:
+            if load_error:
                 logger.error("Failure loading old inventory, unable to compare it to the new one.")
-                logger.error("JSON: " + str(err), exc_info=True)
+                logger.error("JSON: " + str(load_error), exc_info=load_error)
                 identical_invs = False
                 problems = True
             else:
@@ -1081,15 +1295,17 @@ def process_all_subdirectories(d, summary):
     Recursively process directories, adding and/or verifying inventory files in each.
     """
 
-    happy, message = process_one_directory(d)
-    summary['counts'][message] += 1
-    if not happy:
-        summary['failed paths'].append(d)
+    pending = [d]    # explicit stack rather than recursion, so deep trees do not hit the recursion limit
+    while pending:
+        d = pending.pop()
+        happy, message = process_one_directory(d)
+        summary['counts'][message] += 1
+        if not happy:
+            summary['failed paths'].append(d)
 
-    for a_file in os.listdir(d):
-        fullFile = os.path.join(d, a_file)
-        if os.path.isdir(fullFile):
-            process_all_subdirectories(fullFile, summary)
+        with os.scandir(d) as entries:
+            subdirs = [entry.path for entry in entries if entry.is_dir()]
+        pending.extend(reversed(subdirs))    # reversed, so they come off the stack in listing order
 
 
 
@@ -1122,6 +1338,7 @@ def summarize_duplicates():
 def main():
     global args
     global logger
+    global process_pool
 
     def csv(v):
         return v.lower().split(',')
@@ -1139,6 +1356,8 @@ def main():
     parser.add_argument('--also-non-image-files', help='include almost any file in the inventory (by default, only common image formats are included)', action="store_true")
     parser.add_argument('--inventory-file-name', metavar='NAME', help='the name of the per-directory inventory file, without path (default: %(default)s)', default="inventory.json")
     parser.add_argument('--single-thread', help='process using only one thread (by default, uses one thread per CPU thread, up to 4)', action="store_true")
+    parser.add_argument('--reread-image-info', help='read image dates and dimensions from every image, even when an existing inventory has them for an unchanged file', action="store_true")
+    parser.add_argument('--processes', help='examine files in one worker process per CPU thread (by default, uses threads)', action="store_true")
     parser.add_argument('--log', metavar='PATH', help='base log file name (default: %(default)s)', default="inventory.log")
     parser.add_argument('directories', metavar='DIR', nargs='+', help='directories to process')
     args = parser.parse_args()
@@ -1175,8 +1394,16 @@ def main():
             logger.error("The program can not continue.")
             exit(-1)
 
+        if args.processes and args.single_thread:
+            logger.error("Not allowed to combine --processes with --single-thread.")
+            logger.error("The program can not continue.")
+            exit(-1)
+
         start_time = datetime.datetime.now()
 
+        if args.processes:
+            process_pool = ProcessPool(cpu_count())   # no GIL to share, so one per CPU thread
+
         for d in args.directories:
             if args.recursive:
                 summary = {'counts': defaultdict(lambda: 0), 'failed paths': list()}
@@ -1194,6 +1421,10 @@ def main():
                 happy, message = process_one_directory(d)
                 logger.info("Processing result: happy=%s, message='%s'." % (happy,message))
 
+        if process_pool:
+            process_pool.close()
+            process_pool.join()
+
         logger.info("Took %s to generate inventories." % format_elapsed_seconds(elapsed_since(start_time)))
 
         summarize_duplicates()
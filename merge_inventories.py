@@ -9,7 +9,7 @@ import argparse, glob
 import logging
 
 # import from our other scripts
-from inventory import setup_logger, load_json, write_json, parse_dim_str, running_on_windows, InventoryItem
+from inventory import setup_logger, find_inventory_files, load_json_files, write_json, parse_dim_str, running_on_windows, InventoryItem
 
 
 
@@ -19,62 +19,47 @@ args = None
 
 
 
-def process_one_dir(path, directory_summary):
+def process_one_dir(path, raw_contents, directory_summary):
     """
-    Return inventory contents for the given path, if there is an inventory file.
+    Return inventory contents for the given path, given the contents of its inventory file.
     """
 
     logger.info("Process path: %s" % path)
 
+    on_windows = running_on_windows()    # same answer for every item
     contents = []
-    invpath = os.path.join(path,args.inventory_file_name)
-    try:
-        if os.path.exists(invpath) and os.path.isfile(invpath):
-            directory_summary['count'] += 1
-            raw_contents = load_json(invpath)
-
-            for item in raw_contents:
-                item = InventoryItem(item)
-
-                # name ending filters
-                if args.filter_include_name_endings:
-                    if not any([item.name.lower().endswith(e) for e in args.filter_include_name_endings]):
-                        continue
-                if args.filter_exclude_name_endings:
-                    if any([item.name.lower().endswith(e) for e in args.filter_exclude_name_endings]):
-                        continue
-
-                # dimention filters (rejects any inventory entry that lacks this property)
-                if args.filter_min_dimentions:
-                    if (not item.dims) or item.dims[0] < args.filter_min_dimentions[0] or item.dims[1] < args.filter_min_dimentions[1]:
-                        continue
-
-                # filter duplicate files (keep the first example of a duplicate which makes it past the other filters)
-                if args.filter_dupes:
-                    if (item.size, item.checksum) in directory_summary['ids']:
-                        continue
-
-                # path adjustment
-                item.name = os.path.join(path,item.name)     # enhance the file paths with the directory
-                if args.path_trim:                           # optionally remove parts of the path
-                    assert item.name.startswith(args.path_trim), "Cannot trim: %s" % item.name
-                    item.name = item.name[len(args.path_trim):]
-                if running_on_windows():
-                    item.name = item.name.replace("\\","/")  # we need to standardize the path separator so it works between platforms
-
-                if args.filter_dupes:
-                    directory_summary['ids'].add((item.size, item.checksum))
-                contents.append(item.as_tuple())
-    except OSError as err:
-        logger.warning("Failed to read an inventory file.")
-        logger.debug(err,exc_info=True)
-        directory_summary['errors'] += 1
-
-    if args.recursive:
-        for thing in os.listdir(path):
-            thing = os.path.join(path, thing)
-            if os.path.isdir(thing):
-                contents += process_one_dir(thing, directory_summary)
+    for item in raw_contents:
+        # name ending filters (checked on the raw entry, before parsing its date and dimentions)
+        if args.filter_include_name_endings:
+            if not item[0].lower().endswith(args.filter_include_name_endings):
+                continue
+        if args.filter_exclude_name_endings:
+            if item[0].lower().endswith(args.filter_exclude_name_endings):
+                continue
+
+        item = InventoryItem(item)
+
+        # dimention filters (rejects any inventory entry that lacks this property)
+        if args.filter_min_dimentions:
+            if (not item.dims) or item.dims[0] < args.filter_min_dimentions[0] or item.dims[1] < args.filter_min_dimentions[1]:
+                continue
+
+        # filter duplicate files (keep the first example of a duplicate which makes it past the other filters)
+        if args.filter_dupes:
+            if (item.size, item.checksum) in directory_summary['ids']:
+                continue
+
+        # path adjustment
+        item.name = os.path.join(path,item.name)     # enhance the file paths with the directory
+        if args.path_trim:                           # optionally remove parts of the path
+            assert item.name.startswith(args.path_trim), "Cannot trim: %s" % item.name
+            item.name = item.name[len(args.path_trim):]
+        if on_windows:
+            item.name = item.name.replace("\\","/")  # we need to standardize the path separator so it works between platforms
+
+        if args.filter_dupes:
+            directory_summary['ids'].add((item.size, item.checksum))
+        contents.append(item.as_tuple())
 
     return contents
 
@@ -85,7 +70,7 @@ def main():
     global logger
 
     def csv(v):
-        return v.lower().split(',')
+        return tuple(v.lower().split(','))    # a tuple, so str.endswith() can check all of them in one call
 
     # parse arguments
     parser = argparse.ArgumentParser(description='Create one large inventory from small ones which are distributed in the various image directories.')
@@ -124,10 +109,21 @@ def main():
                 logger.error("The program can not continue.")
                 exit(-1)
 
+        found = []
+        for d in args.directories:
+            find_inventory_files(d, args.inventory_file_name, recursive=args.recursive, found=found)
+
+        # the files are read in the background, but processed in order (the first of any duplicates is the one kept)
         directory_summary = {'count': 0, 'errors': 0, 'ids': set()}
         merged_inventory = []
-        for d in args.directories:
-            merged_inventory += process_one_dir(d, directory_summary)
+        for (path,_),raw_contents in zip(found, load_json_files([invpath for _,invpath in found])):
+            directory_summary['count'] += 1
+            if isinstance(raw_contents, OSError):
+                logger.warning("Failed to read an inventory file.")
+                logger.debug(raw_contents,exc_info=raw_contents)
+                directory_summary['errors'] += 1
+                continue
+            merged_inventory += process_one_dir(path, raw_contents, directory_summary)
         logger.info("Found %d inventory files containing %d records." % (directory_summary['count'],len(merged_inventory)))
         logger.info("Encountered %d errors loading inventories." % directory_summary['errors'])
 
@@ -12,15 +12,15 @@ FIXME: Specifying a subpath to process causes the files to be re-uploaded.
 '''
 
 import argparse, logging
-import io
 import glob, os
 from collections import defaultdict
 import datetime
 import re
+import shutil
+import subprocess
+import threading
 import boto3
-import gnupg   # pip install python-gnupg
 from urllib.parse import urlencode
-import zipfile
 
 # local files
 from inventory import setup_logger, elapsed_since, format_elapsed_seconds
@@ -32,13 +32,19 @@ from rename_images import checksum
 logger = None
 args = None
 phrase = None
-gpg = None
 s3_observed_keys = set()            # strings: S3 key (in S3)
 local_observed_keys = set()         # strings: S3 key (from local paths and params)
 
-# only encrypt and compress certain files
-secret_files = set(('.jpg','.jpeg','.png','mp4','.mov','.avi','.wmv','.mpg','.cr2'))
-other_files = set(('.json',))
+# only encrypt certain files
+secret_files = frozenset(('.jpg','.jpeg','.png','.mp4','.mov','.avi','.wmv','.mpg','.cr2'))
+other_files = frozenset(('.json',))
+file_classes = dict([(ext,'secret') for ext in secret_files] + [(ext,'other') for ext in other_files])
+
+# symmetric encryption by the gpg binary, the passphrase is the first line on stdin and the file follows
+# JPEG/MP4/etc are already compressed, so gpg should not spend time trying to compress them again
+GPG_CMD = ['gpg','--batch','--yes','--quiet','--passphrase-fd','0','--symmetric','--cipher-algo','AES256','--compress-algo','none']
+GPG_CHUNK = 1024 * 1024
+MULTIPART_CHUNK = 16 * 1024 * 1024     # S3 wants at least 5 MiB for all but the last part
 
 
 
@@ -60,14 +66,135 @@ def prefix():
 
 
 
+def gpg_encrypt(path):
+    """
+    Encrypt the given file with gpg, yielding the encrypted output in chunks.
+    """
+
+    proc = subprocess.Popen(GPG_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    feed_errors = []
+
+    def feed():
+        # runs in a thread so that gpg never blocks on a full stdout pipe while we are still writing
+        try:
+            proc.stdin.write(phrase.encode('utf8') + b"\n")
+            with open(path,"rb") as fh:
+                shutil.copyfileobj(fh, proc.stdin, GPG_CHUNK)
+        except BrokenPipeError:
+            pass      # gpg quit early, the return code will tell us why
+        except Exception as err:
+            feed_errors.append(err)
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            chunk = proc.stdout.read(GPG_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        proc.stdout.close()     # if we are abandoned early, this makes gpg (and then the feeder) give up
+        feeder.join()
+        err = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+
+    if feed_errors:
+        raise feed_errors[0]    # gpg would have happily encrypted a truncated file
+    if proc.returncode != 0:
+        raise Exception("The gpg process failed with code %d: %s" % (proc.returncode, err.decode('utf8','replace').strip()))
+
+
+
+def upload_stream(key, chunks, storage_class, tags):
+    """
+    Upload data given as an iterable of byte strings to S3, using a multipart upload if it is large.
+
+    At most about one part of data is held in RAM at a time.
+    """
+
+    chunks = iter(chunks)
+
+    def next_part():
+        part = bytearray()
+        for chunk in chunks:
+            part += chunk
+            if len(part) >= MULTIPART_CHUNK:
+                break
+        return bytes(part)
+
+    part = next_part()
+    if len(part) < MULTIPART_CHUNK:
+        # everything fit in one part, which is the normal case for images
+        s3_client.put_object(
+            Body         = part,
+            Bucket       = args.bucket,
+            Key          = key,
+            StorageClass = storage_class,
+            Tagging      = urlencode(tags)
+        )
+        return
+
+    mpu = s3_client.create_multipart_upload(
+        Bucket       = args.bucket,
+        Key          = key,
+        StorageClass = storage_class,
+        Tagging      = urlencode(tags)
+    )
+    parts = []
+    try:
+        while part:
+            resp = s3_client.upload_part(
+                Body       = part,
+                Bucket     = args.bucket,
+                Key        = key,
+                PartNumber = len(parts) + 1,
+                UploadId   = mpu['UploadId']
+            )
+            parts.append({'ETag': resp['ETag'], 'PartNumber': len(parts) + 1})
+            part = next_part()
+        s3_client.complete_multipart_upload(
+            Bucket          = args.bucket,
+            Key             = key,
+            UploadId        = mpu['UploadId'],
+            MultipartUpload = {'Parts': parts}
+        )
+    except Exception:
+        logger.warning("Abort the multipart upload to key: %s" % key)
+        s3_client.abort_multipart_upload(Bucket=args.bucket, Key=key, UploadId=mpu['UploadId'])
+        raise
+
+
+
+def remove_old_zip_key(key):
+    """
+    Delete the zip-wrapped copy of an encrypted file that older versions of this script uploaded as '<key>.zip', if there is one.
+    """
+
+    old_key = key + ".zip"
+    if old_key in s3_observed_keys:
+        logger.info("Delete the old zip-wrapped key: %s" % old_key)
+        s3_client.delete_object(Bucket=args.bucket, Key=old_key)
+        s3_observed_keys.discard(old_key)    # so the --sync cleanup does not count it again
+
+
+
 def one_file(path):
     """
     Given an file path to process, return a string representing the action taken.
     """
 
-    _, ext = os.path.splitext(path.lower())
-    if not (ext in other_files or ext in secret_files):
+    ext = os.path.splitext(path)[1].lower()     # lowercase only the extension, not the whole path
+    file_class = file_classes.get(ext)
+    if file_class is None:
         return 'ignored'
+    secret = file_class == 'secret'
 
     info = os.stat(path)
     if info.st_size > 512 * 1024 and (not args.temp_upload):
@@ -91,8 +218,8 @@ def one_file(path):
     path2 = path2[len(args.local_tree_root):]
     key = path2.replace('\\','/').strip('/')
     key = prefix() + key
-    if ext in secret_files:           # only encrypt and compress certain files
-        key += ".gpg.zip"
+    if secret:                        # only encrypt certain files
+        key += ".gpg"
     local_observed_keys.add(key)
 
     with open(path,"rb") as fh:
@@ -104,7 +231,7 @@ def one_file(path):
             info.st_mtime,
             path2.encode('utf8'),
             key.encode('utf8'),
-            phrase.encode('utf8') if ext in secret_files else b''
+            phrase.encode('utf8') if secret else b''
         )
         tags['UniqueCheck'] = checksum((b"%d:%d:%s:%s:%s:" % vals) + dat)
         if key in s3_observed_keys:
@@ -112,51 +239,43 @@ def one_file(path):
             if unique_tag == tags['UniqueCheck']:
                 if not args.make_changes:
                     logger.debug("The key '%s' looks good in S3." % key)
+                elif secret:
+                    remove_old_zip_key(key)     # in case it was uploaded by a version that did not clean up
                 return 'already in S3 with the right tag'   # this file is already in S3 with the expected UniqueCheck tag value
             else:
                 logger.debug("The key '%s' is present in S3, but with the wrong value for 'UniqueCheck'." % key)  # wrong password, changed file, etc
                 logger.debug("  local: %s, S3: %s" % (tags['UniqueCheck'],unique_tag))
                 logger.debug("  st_size: %d, st_mtime: %d" % (info.st_size,info.st_mtime))
 
-        dat += fh.read()    # it had better fit in RAM
+        if args.make_changes and not secret:
+            dat += fh.read()    # it had better fit in RAM (secret files are streamed through gpg instead)
 
     if not args.make_changes:
         logger.debug("The key '%s' needs to be uploaded." % key)
 
-    if ext in secret_files:           # only encrypt and compress certain files
-        # encrypt
-        encrypted_data = gpg.encrypt(dat, None, symmetric=True, passphrase=phrase)
-        decrypted_stream = io.BytesIO(encrypted_data.data)
-        encrypted_data = decrypted_stream.read()
-
-        # pack the encrypted data into a zip archive held in RAM
-        archive = io.BytesIO()
-        with zipfile.ZipFile(archive, mode='w', compression=zipfile.ZIP_DEFLATED) as ziparchive:
-             with ziparchive.open(os.path.split(path)[1]+".gpg", 'w') as fh:
-                fh.write(encrypted_data)
-        archive.seek(0)
-        upload_data = archive.read()
-    else:
-        upload_data = dat
-
     if args.make_changes:
         logger.info("Upload to key: %s" % key)
-        s3_client.put_object(
-            Body         = upload_data,
-            Bucket       = args.bucket,
-            Key          = key,
-            StorageClass = storage_class,
-            Tagging      = urlencode(tags)
-        )
-    else:
-        logger.info("Would have uploaded to key: %s" % key)
-        logger.info("Tags: %s" % urlencode(tags))
-        if ext in secret_files:
-            logger.info("Data inflation gpg: %d to %d (%0.01f%%)." % (len(dat),len(encrypted_data),100.0*len(encrypted_data)/len(dat)))
-            logger.info("Data inflation zip: %d to %d (%0.01f%%)." % (len(dat),len(upload_data),100.0*len(upload_data)/len(dat)))
-
-    if args.make_changes:
+        if secret:                    # only encrypt certain files
+            upload_stream(key, gpg_encrypt(path), storage_class, tags)
+            remove_old_zip_key(key)
+        else:
+            s3_client.put_object(
+                Body         = dat,
+                Bucket       = args.bucket,
+                Key          = key,
+                StorageClass = storage_class,
+                Tagging      = urlencode(tags)
+            )
         return 'uploaded'
+
+    logger.info("Would have uploaded to key: %s" % key)
+    logger.info("Tags: %s" % urlencode(tags))
+    if secret and key + ".zip" in s3_observed_keys:
+        logger.info("Would have deleted the old zip-wrapped key: %s.zip" % key)
+    if secret and args.dryrun_stats:  # encrypting just to measure it is slow, so only on request
+        encrypted_size = sum(len(chunk) for chunk in gpg_encrypt(path))
+        logger.info("Data inflation gpg: %d to %d (%0.01f%%)." % (info.st_size,encrypted_size,100.0*encrypted_size/max(info.st_size,1)))
+
     return 'would have uploaded'
 
 
@@ -308,7 +427,6 @@ def main():
     global args
     global logger
     global phrase
-    global gpg
     global s3_client
 
     def subpath(v):
@@ -329,6 +447,7 @@ def main():
     group.add_argument('--temp-upload', metavar="SUBPATH", type=subpath, help='upload to temp/ with the given subpath')
     group.add_argument('--workstation-upload', metavar="SUBPATH", type=subpath, help='upload to workstation/ with the given subpath')
     group.add_argument('--server-upload', metavar="SUBPATH", type=subpath, help='upload to server/ with the given subpath')
+    parser.add_argument('--dryrun-stats', help='without --make-changes, still encrypt files to report how much they would grow', action="store_true")
     parser.add_argument('--limit', metavar='NUM', type=int, help='limit how many files to process')
     parser.add_argument('--log', metavar='PATH', help='base log file name (default: %(default)s)', default="s3_backup.log")
     args = parser.parse_args()
@@ -344,8 +463,6 @@ def main():
         exit(-1)
 
     try:
-        logging.getLogger('gnupg').setLevel(logging.INFO)
-        gpg = gnupg.GPG()
         phrase = input("Enter the passphrase to encrypt the file(s): ")
         s3_client = boto3.client('s3')     # rely on env vars, or .aws/config, or magical IAM Role
         list_s3()
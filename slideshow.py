@@ -4,16 +4,27 @@ Make a semi-random slideshow from one or more inventory files.
 
 import os
 import argparse
+import hashlib
+import bisect
+import functools
+import heapq
+import itertools
+import random
 import glob, re
 import logging
-from collections import defaultdict
+import numpy
 import pygame    # requires at least version 2.1.3
 import piexif
 from PIL import Image
-from time import sleep, time
+from time import time
 from datetime import datetime
-from random import choice
-from threading import Thread, Condition
+from threading import Condition, Lock, Thread, get_ident
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB    # optional, faster JPEG decoding with libjpeg-turbo
+    turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError):
+    turbo_jpeg = None
 
 # import from our other files
 from inventory import setup_logger, load_json, InventoryItem
@@ -23,18 +34,47 @@ from inventory import setup_logger, load_json, InventoryItem
 # globals
 logger = None
 args = None
+windowed_res = (1024,768)
 
 
 
-def load_inventories(inventory_files, remove_dupes=True):
+def verify_files(paths):
+    """
+    Raise an exception if any of the given paths is not a file.  Reads each directory once rather than checking each file.
+    """
+
+    dir_listings = dict()
+    for path in paths:
+        pathpart,filepart = os.path.split(path)
+        if pathpart not in dir_listings:
+            try:
+                with os.scandir(pathpart or '.') as it:
+                    dir_listings[pathpart] = set(entry.name for entry in it if entry.is_file())
+            except OSError:
+                dir_listings[pathpart] = set()
+        assert filepart in dir_listings[pathpart], "The path %s is not a file." % path
+
+
+
+def sort_key(item):
+    """
+    Key to sort InventoryItem objects by date, oldest first.
+    """
+
+    return (item.date,item.name)
+
+
+
+def load_inventories(inventory_files, remove_dupes=True, verify_paths=False):
     """
     Load the inventory files and merge the contents.  Filter unusable content.  Return list of InventoryItem sorted oldest first.
     """
 
     checksums = set()
-    newlist = list()
+    sources = list()     # one list per inventory file, each sorted
 
     for f in inventory_files:
+        newlist = list()
         invpathpart, _ = os.path.split(f)
         contents = load_json(f)
         logger.info("Inventory file contains %d items." % len(contents))
@@ -56,103 +96,120 @@ def load_inventories(inventory_files, remove_dupes=True):
                 newitem.name = os.path.join(invpathpart,filepart)
             else:
                 newitem.name = item[0]
-            assert os.path.isfile(newitem.name), "The path %s is not a file." % newitem.name
             newlist.append(newitem)
+        newlist.sort(key=sort_key)
+        sources.append(newlist)
 
-    return sorted(newlist, key=lambda x: (x.date,x.name))    # sort by date, oldest first
+    newlist = list(heapq.merge(*sources, key=sort_key))    # sort by date, oldest first
 
+    if verify_paths:
+        verify_files(x.name for x in newlist)
 
+    return newlist
 
-def select_image_subset(image_info_list):
-    """
-    Select a subset of images to show.  Return a tuple: (paths, dict() mapping the paths to date tuples)
-    """
 
-    # group by year, month
-    grouped = defaultdict(lambda: [])
-    path_to_date = dict()
-    for image_info in image_info_list:    # InventoryItem objects
-        dt = image_info.date
-        path = image_info.name
-        grouped[(dt[0],dt[1])].append((dt,path))
-        path_to_date[path] = tuple(dt)
-
-    # drop the year/month keys, key only lists
-    grouped = [v for _,v in sorted(grouped.items())]
-
-    # if a month has too few pictures, combine it with the following month(s)
-    re_grouped = [[]]
-    for g in grouped:
-        if len(re_grouped[-1]) < 500:
-            re_grouped[-1] = re_grouped[-1] + g
-        else:
-            re_grouped.append(g)
-    assert sum(len(x) for x in re_grouped) == sum(len(x) for x in grouped), "Lost some images."
 
-    # select two per bucket
-    paths = []
-    for g in re_grouped:
-        for _ in range(3):
-            paths.append(choice(g))
+def select_image_subset(image_index):
+    """
+    Select a subset of images to show.  Return a list of paths, sorted by date.
+    """
 
-    # sort by date, then drop the date
-    paths = [path for _,path in sorted(paths)]
+    # group by year, month (rows are sorted by date, so each month is a contiguous range of rows)
+    dates = image_index.dates
+    ym = dates[:,0].astype(numpy.int32) * 13 + dates[:,1]
+    _, month_starts = numpy.unique(ym, return_index=True)
+    month_ends = numpy.append(month_starts[1:], len(ym))
+
+    # if a month has too few pictures, combine it with the following month(s), so a bucket ends at the first month end at least 500 rows on
+    bucket_starts = []
+    bucket_ends = []
+    start = 0
+    while start < len(ym):
+        end_idx = min(numpy.searchsorted(month_ends, start + 500), len(month_ends) - 1)
+        bucket_starts.append(start)
+        bucket_ends.append(month_ends[end_idx])
+        start = month_ends[end_idx]
+    bucket_starts = numpy.array(bucket_starts, dtype=numpy.int64)
+    bucket_ends = numpy.array(bucket_ends, dtype=numpy.int64)
+    assert int((bucket_ends - bucket_starts).sum()) == len(ym), "Lost some images."
+
+    # select three different rows per bucket (sampling a range does not build it, so this is cheap even for big buckets)
+    chosen = [row for start,end in zip(bucket_starts.tolist(), bucket_ends.tolist()) for row in random.sample(range(start, end), min(3, end - start))]
+
+    # sort by date (the row order)
+    chosen.sort()
+    paths = [image_index.paths[row] for row in chosen]
 
     logger.debug("Lets show: %s" % str(paths))
     logger.info("Have chosen %d images to show." % len(paths))
 
-    return paths,path_to_date
+    return paths
 
 
 
-def more_images(current_idx, current_paths, path_to_date, image_info_list):
+class ImageIndex():
     """
-    Extend the subset of images to show, centered on the given image.  Return the new index and paths.
+    Image paths and dates stored as parallel arrays, built once since the inventory contents do not change during a show.
     """
 
-    # arrange images by dates (which are 6-element tuples)
-    dt_to_paths = defaultdict(lambda: [])
-    for image_info in image_info_list:    # InventoryItem objects
-        dt_to_paths[tuple(image_info.date)].append(image_info.name)
+    def __init__(self, image_info_list):
+        # image_info_list is InventoryItem objects sorted by date, row numbers refer to that order
+        self.paths = [image_info.name for image_info in image_info_list]
+        self.dates = numpy.fromiter(itertools.chain.from_iterable(image_info.date for image_info in image_info_list), dtype=numpy.int16, count=6*len(self.paths)).reshape(-1, 6)
+        self.path_idx = dict((p,i) for i,p in enumerate(self.paths))
+
+        # each distinct date is a contiguous range of rows
+        changes = numpy.flatnonzero(numpy.any(self.dates[1:] != self.dates[:-1], axis=1)) + 1
+        self.date_starts = numpy.concatenate(([0], changes)) if len(self.paths) else numpy.array([], dtype=numpy.int64)
+        self.date_ends = numpy.append(self.date_starts[1:], len(self.paths))
+        self.row_dt_index = numpy.repeat(numpy.arange(len(self.date_starts)), self.date_ends - self.date_starts)
 
-    # get all possible dates in a list sorted list
-    all_date_list = sorted(dt_to_paths.keys())
-    logger.info("The list of distinct dates is %d elements." % len(all_date_list))
+        logger.info("The list of distinct dates is %d elements." % len(self.date_starts))
+
+    def date_of(self, path):
+        """
+        Return the date (a 6-element tuple) of the given path.
+        """
+
+        return tuple(int(x) for x in self.dates[self.path_idx[path]])
+
+
+
+def more_images(current_idx, current_paths, image_index):
+    """
+    Extend the subset of images to show, centered on the given image.  Return the new index and paths.
+    """
 
     # find the date index of our currently displayed image (so we can search near it)
-    dt_index = None
-    for dt,paths in dt_to_paths.items():
-        if current_paths[current_idx] in paths:
-            dt_index = all_date_list.index(dt)
+    current_row = image_index.path_idx.get(current_paths[current_idx])
+    assert current_row != None, "Failed to find our date index."
+    dt_index = int(image_index.row_dt_index[current_row])
+    num_dates = len(image_index.date_starts)
 
     logger.info("Have determined that our current index in the list of dates is %s." % dt_index)
-    assert dt_index != None, "Failed to find our date index."
 
     pathset = set(current_paths)
     added = []
 
     def addfunc(dt_idx):
-        if dt_idx >= 0 and dt_idx < len(all_date_list):
-            dt = all_date_list[dt_idx]
-            for path in dt_to_paths[dt]:
+        if dt_idx >= 0 and dt_idx < num_dates:
+            for path in image_index.paths[image_index.date_starts[dt_idx]:image_index.date_ends[dt_idx]]:
                 if path not in pathset:
                     logger.info("Add path: %s" % path)
                     added.append(path)
 
-    # find nearby images that we don't already have
+    # find nearby images that we don't already have, starting with those from the same date
+    addfunc(dt_index)
     working_dt_idx_offset = 1
-    while len(added) < 20 and len(added) + len(current_paths) < len(image_info_list):
+    while len(added) < 20 and working_dt_idx_offset < num_dates:
         addfunc(dt_index - working_dt_idx_offset)
         addfunc(dt_index + working_dt_idx_offset)
         working_dt_idx_offset += 1
-        assert working_dt_idx_offset < len(all_date_list), "Runaway date list index."
 
-    new_paths = []
-    for path in current_paths+added:
-        dt = path_to_date[path]
-        new_paths.append((dt,path))
-    new_paths = [x[1] for x in sorted(new_paths)]
-    new_idx = new_paths.index(current_paths[current_idx])
+    # sort by date (the row order)
+    rows = numpy.sort(numpy.fromiter((image_index.path_idx[path] for path in current_paths+added), dtype=numpy.int64))
+    new_paths = [image_index.paths[row] for row in rows]
+    new_idx = int(numpy.searchsorted(rows, current_row))
 
     logger.debug("New paths: %s" % str(new_paths))
 
@@ -160,156 +217,436 @@ def more_images(current_idx, current_paths, path_to_date, image_info_list):
 
 
 
+def open_jpeg_turbo(path, target):
+    """
+    Decode a JPEG with libjpeg-turbo, scaled down in the IDCT by the largest factor that still covers the target box.  Returns a PIL image.
+    """
+
+    with open(path, "rb") as fh:
+        dat = fh.read()
+    wid, hig = turbo_jpeg.decode_header(dat)[:2]
+    factor = (1,1)
+    for num,denom in turbo_jpeg.scaling_factors:
+        if num/denom < factor[0]/factor[1] and -(-wid*num//denom) >= target[0] and -(-hig*num//denom) >= target[1]:
+            factor = (num,denom)
+    arr = turbo_jpeg.decode(dat, pixel_format=TJPF_RGB, scaling_factor=factor)
+    return Image.fromarray(arr)
+
+
+
+def readahead(path):
+    """
+    Ask the OS to start reading a file into the page cache, where that is supported.  Returns right away.
+    """
+
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as err:
+        logger.debug("Failed to read ahead: %s (%s)" % (path,err))
+
+
+
+def read_orientation(path, imgobj=None):
+    """
+    Return the EXIF orientation value for an image, or None.  With an opened PIL image, only its IFD0 is parsed.  Otherwise, for JPEG, only the header segments up to the EXIF data are read.
+    """
+
+    try:
+        if imgobj is not None:
+            return imgobj.getexif().get(piexif.ImageIFD.Orientation)
+        exif_dict = piexif.load(path)
+    except Exception as err:
+        logger.debug("Failed to read EXIF orientation: %s" % path)
+        logger.debug(err, exc_info=True)
+        return None
+    return exif_dict["0th"].get(piexif.ImageIFD.Orientation)
+
+
+
 class ImageCache():
-    def __init__(self, resolutions, paths, cache_count):
+    def __init__(self, resolutions, paths, cache_count, workers=None, disk_cache=None, disk_cache_limit=4096*1024*1024):
         self.resolutions = resolutions    # tuple or list/tuple of tuples for the resolution(s) to cache images at
         self.paths = paths                # paths to image files, sorted by date (but the date is not provided here)
         self.path_to_idx = dict((p,i) for i,p in enumerate(paths))
-        self.run = True
         self.cache_count = cache_count
+        self.disk_cache = disk_cache      # directory to keep scaled images in between runs, or None
+        self.disk_cache_limit = disk_cache_limit    # bytes, the least recently used files are deleted beyond this
 
         self.image_cache = dict()         # map indexes of cached images to pygame surfaces
+        self.cached_idxs = []             # sorted keys of image_cache
+        self.loading = set()              # paths of images that have been handed to the worker pool
+        self.failed = set()               # paths of images that could not be loaded, which we will not try again
+        self.orientations = dict()        # map paths to EXIF orientation values, which do not depend on the resolution
+        self.readahead_path = None        # the last path we asked the OS to read ahead
         self.current_idx = 0
+        self.direction = 1                # which way the show last moved (1 or -1), images ahead of us are preferred over those behind
+        self.running = True               # cleared by close(), after which nothing more is loaded
         self.image_cache_lock = Condition()
+        self.disk_cache_lock = Lock()     # protects disk_cache_bytes and pruning
 
-        self.thread = Thread(target=self.worker)
-        self.thread.daemon = True
-        self.thread.start()
+        if self.disk_cache:
+            with self.disk_cache_lock:
+                self.prune_disk_cache()   # also finds out how much is there
 
-    def multiple_resolutions(self):
+        # decoding and scaling happens mostly in C code that releases the GIL, so several threads are useful
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        with self.image_cache_lock:
+            self.schedule()
+
+    def multiple_resolutions(self, resolutions=None):
         """
         Return True if the image cache will contain single surfaces for each image, False if it will contain a list of them (also a 1-element list).
         """
 
-        assert self.resolutions, "The resolutions cannot be False-ey."
-        return not bool(len(self.resolutions) == 2 and type(self.resolutions[0]) in (int,float) and type(self.resolutions[1]) in (int,float))
+        resolutions = resolutions or self.resolutions
+        assert resolutions, "The resolutions cannot be False-ey."
+        return not bool(len(resolutions) == 2 and type(resolutions[0]) in (int,float) and type(resolutions[1]) in (int,float))
+
+    def decode_size(self, res_list, oval):
+        """
+        Return the (width,height) box to decode an image into, the largest resolution we cache at.
+        """
+
+        wid = int(max(res[0] for res in res_list))
+        hig = int(max(res[1] for res in res_list))
+        if oval in (6,8):
+            return (hig,wid)      # the image will be rotated by 90 degrees after decoding
+        return (wid,hig)
+
+    def distance(self, idx):
+        """
+        Return how far an index is from the current one, images behind the direction of travel count as three times as far.
+        """
+
+        offset = idx - self.current_idx
+        if offset * self.direction < 0:
+            return -3 * offset * self.direction
+        return abs(offset)
+
+    def nearest_uncached(self):
+        """
+        Return the index nearest the current index that is not cached, loading or failed, or None.  Call with the lock held.
+        """
+
+        # search outward (in order of distance()), usually the first gap is only about half the cache size away
+        for offset in range(3 * len(self.paths)):
+            candidates = [self.current_idx + offset * self.direction]
+            if offset and offset % 3 == 0:
+                candidates.append(self.current_idx - offset // 3 * self.direction)
+            for idx in candidates:
+                if idx < 0 or idx >= len(self.paths) or idx in self.image_cache:
+                    continue
+                path = self.paths[idx]
+                if path not in self.loading and path not in self.failed:
+                    return idx
+        return None
+
+    def cache(self, idx, surfaces):
+        """
+        Store the surface(s) for an index.  Call with the lock held.
+        """
+
+        if idx not in self.image_cache:
+            bisect.insort(self.cached_idxs, idx)
+        self.image_cache[idx] = surfaces
+
+    def uncache(self, idx):
+        """
+        Forget the surface(s) for an index.  Call with the lock held.
+        """
+
+        del self.image_cache[idx]
+        del self.cached_idxs[bisect.bisect_left(self.cached_idxs, idx)]
 
-    def worker(self):
+    def schedule(self):
         """
-        Function to invoke from a background thread.  Runs until all images are cached.
+        Hand the images nearest the current index to the worker pool, unloading distant images to make room.  Call with the lock held.
+        """
+
+        if not self.running:
+            return
+
+        while len(self.loading) < min(self.workers, self.cache_count):    # never more loading than the cache can hold, or there would be nothing to unload
+            # find images most suitable to load and to unload
+            best_idx = self.nearest_uncached()
+            if best_idx == None:
+                logger.debug("Everything seems to be cached or loading (%d images in list, current idx %d)." % (len(self.paths),self.current_idx))
+                return
+            best_score = self.distance(best_idx)
+
+            # clean up the cache
+            if len(self.image_cache) + len(self.loading) > self.cache_count:
+                # the cached index farthest from the current one is at one end of the sorted list
+                assert self.cached_idxs, "Somehow the cache is full without any cached images."
+                worst_idx = max(self.cached_idxs[0], self.cached_idxs[-1], key=self.distance)
+                worst_score = self.distance(worst_idx)
+                if worst_score <= best_score+1:
+                    logger.debug("The cache is full of images nearer than idx %d." % best_idx)
+                    return
+                logger.debug("Unload idx %d." % worst_idx)
+                self.uncache(worst_idx)
+
+            logger.debug("Load idx %d." % best_idx)
+            path = self.paths[best_idx]
+            self.loading.add(path)
+            self.pool.submit(self.worker, path, self.resolutions)
+
+        # every worker is busy, so have the OS start reading the image that is likely to be loaded next (the disk cache has its own files)
+        next_idx = self.nearest_uncached()
+        if next_idx == None or self.disk_cache or self.paths[next_idx] == self.readahead_path:
+            return
+        if len(self.image_cache) + len(self.loading) > self.cache_count and self.cached_idxs:
+            if max(self.distance(self.cached_idxs[0]), self.distance(self.cached_idxs[-1])) <= self.distance(next_idx)+1:
+                return    # it would not be loaded
+        self.readahead_path = self.paths[next_idx]
+        Thread(target=readahead, args=(self.readahead_path,), daemon=True).start()
+
+    def disk_cache_paths(self, path, res_list):
+        """
+        Return the disk cache file paths for an image at each of the given resolutions.  The file modification time is part of the key.
+        """
+
+        info = os.stat(path)
+        paths = []
+        for one_res in res_list:
+            key = "%s|%d|%d|%dx%d" % (os.path.abspath(path), info.st_mtime_ns, info.st_size, int(one_res[0]), int(one_res[1]))
+            paths.append(os.path.join(self.disk_cache, hashlib.sha1(key.encode('utf8')).hexdigest() + ".raw"))
+        return paths
+
+    def read_disk_cache(self, cache_paths, res_list):
+        """
+        Return a list of surfaces from the disk cache, or None if any of them are missing.
+        """
+
+        result_surfaces = []
+        for cache_path,one_res in zip(cache_paths, res_list):
+            size = (int(one_res[0]), int(one_res[1]))
+            try:
+                with open(cache_path, "rb") as fh:
+                    dat = fh.read()
+            except FileNotFoundError:
+                return None
+            try:
+                os.utime(cache_path)      # the modification time tells prune_disk_cache() when the file was last used
+            except OSError:
+                pass
+            if len(dat) != size[0] * size[1] * 3:
+                logger.warning("Ignore disk cache file with unexpected size: %s" % cache_path)
+                return None
+            # copy into a surface of the default (display) pixel format, here in the worker, rather than converting from 24-bit RGB on every blit
+            srf = pygame.Surface(size)
+            srf.blit(pygame.image.frombuffer(dat, size, "RGB"), (0,0))
+            result_surfaces.append(srf)
+        return result_surfaces
+
+    def write_disk_cache(self, cache_paths, result_surfaces):
+        """
+        Store surfaces in the disk cache as raw RGB.  Failure is not a problem for the caller.
         """
 
         try:
-            while self.run:
-                with self.image_cache_lock:
-                    # we'll be doing some work with the lock held because the list of paths can be changed on us
-
-                    # find images most suitable to load and to unload
-                    best_idx = None
-                    best_score = len(self.paths)+1
-                    worst_idx = None
-                    worst_score = 0
-                    for maybe_idx in range(len(self.paths)):
-                        score = abs(maybe_idx - self.current_idx)
-                        if maybe_idx in self.image_cache:
-                            if score > worst_score:
-                                worst_score = score
-                                worst_idx = maybe_idx
-                        else:
-                            if score < best_score:
-                                best_score = score
-                                best_idx = maybe_idx
-
-                    if best_idx == None:
-                        logger.debug("Everything seems to be cached (%d images in list, current idx %d)." % (len(self.paths),self.current_idx))
-                        assert len(self.image_cache) == len(self.paths), "Somehow not all images where cached when expected."
-                        self.thread = None
-                        return
-                    logger.debug("Maybe load idx %d?" % best_idx)
-                    path = self.paths[best_idx]
-
-                    # clean up the cache
-                    if len(self.image_cache) > self.cache_count and worst_score > best_score+1:
-                        logger.debug("Unload idx %d." % worst_idx)
-                        assert worst_idx != None, "Somehow the worst index was not set."
-                        assert worst_idx != best_idx, "Somehow the best and worst indexes match."
-                        del self.image_cache[worst_idx]
-
-                if len(self.image_cache) <= self.cache_count+1:
-
-                    # load an image
-                    logger.info("Load: %s" % path)
-                    with Image.open(path) as imgobj:
-                        exif_dict = piexif.load(imgobj.info['exif'])    # should not be here without usable EXIF
-                        oval = exif_dict["0th"].get(piexif.ImageIFD.Orientation)
-                        logger.debug("Orientation value: %s" % oval)
-                        srf = pygame.image.frombytes(imgobj.tobytes(), imgobj.size, "RGB")
-                        if oval == 6:
-                            # rotate CW 90
-                            srf = pygame.transform.rotate(srf,270)
-                        elif oval == 8:
-                            # rotate 90 CCW
-                            srf = pygame.transform.rotate(srf,90)
-                        elif oval == 3:
-                            # rotate 180
-                            srf = pygame.transform.rotate(srf,180)
-                    wid,hig = srf.get_size()
-
-                    with self.image_cache_lock:
-                        # we'll be doing some work with the lock held because the output res can be changed on us
-
-                        single_result = not self.multiple_resolutions()
-                        if single_result:
-                            resolutions = [self.resolutions]
-                        else:
-                            resolutions = self.resolutions
-                        result_surfaces = []
-
-                        for one_res in resolutions:
-                            widr = wid / one_res[0]
-                            higr = hig / one_res[1]
-                            if widr >= higr:
-                                # too wide, black bars top & bottom (or perfect fit)
-                                scale_res = (one_res[0],one_res[1]*(higr/widr))
-                                paste_at = (0,(one_res[1]-scale_res[1])/2)
-                            else:
-                                # too tall, black bars left & right
-                                scale_res = (one_res[0]*(widr/higr),one_res[1])
-                                paste_at = ((one_res[0]-scale_res[0])/2,0)
-                            srf2 = pygame.transform.smoothscale(srf,scale_res)
-                            blksrf = pygame.Surface(one_res)
-                            blksrf.blit(srf2,paste_at)
-                            result_surfaces.append(blksrf)
-
-                        # store the result, careful to protect against the list of paths having changed
-                        if path in self.path_to_idx:
-                            idx = self.path_to_idx[path]
-                            if single_result:
-                                self.image_cache[idx] = result_surfaces[0]
-                            else:
-                                self.image_cache[idx] = tuple(result_surfaces)
-                            logger.debug("Add loaded image idx %d to the cache." % idx)
-
-                            # let the main thread know, in case its waiting
-                            self.image_cache_lock.notify_all()
-                        else:
-                            logger.info("Freshly-loaded image no longer has a valid path.")
+            os.makedirs(self.disk_cache, exist_ok=True)
+            for cache_path,srf in zip(cache_paths, result_surfaces):
+                temp_path = "%s.%d.tmp" % (cache_path, get_ident())    # other workers can be writing the same thing
+                dat = pygame.image.tobytes(srf, "RGB")
+                with open(temp_path, "wb") as fh:
+                    fh.write(dat)
+                os.replace(temp_path, cache_path)
+                with self.disk_cache_lock:
+                    self.disk_cache_bytes += len(dat)
+                    if self.disk_cache_bytes > self.disk_cache_limit:
+                        self.prune_disk_cache()
+        except OSError as err:
+            logger.warning("Failed to write to the disk cache: %s" % err)
+
+    def prune_disk_cache(self):
+        """
+        Delete the least recently used files in the disk cache until it is comfortably below its size limit, and note the size that remains.  Call with disk_cache_lock held.
+        """
 
-                else:
-                    logger.debug("Background thread sleeping.")
-                    sleep(0.5)
+        files = []
+        try:
+            with os.scandir(self.disk_cache) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".raw") and entry.is_file():
+                        info = entry.stat()
+                        files.append((info.st_mtime, info.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+
+        total = sum(size for _,size,_ in files)
+        if total > self.disk_cache_limit:
+            # go down to 90%, so that we are not back here after every write
+            removed = 0
+            for _,size,cache_path in sorted(files):
+                if total <= self.disk_cache_limit * 0.9:
+                    break
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            logger.info("Removed %d files from the disk cache, %d MB remain." % (removed, total // (1024*1024)))
+        self.disk_cache_bytes = total
+
+    def orientation(self, path, imgobj=None):
+        """
+        Return the EXIF orientation value for an image, or None.  Uses the EXIF data of an opened PIL image if given, rather than reading the file again.
+        """
+
+        if path not in self.orientations:
+            self.orientations[path] = read_orientation(path, imgobj)
+            logger.debug("Orientation value: %s" % self.orientations[path])
+        return self.orientations[path]
+
+    def load_surfaces(self, path, res_list):
+        """
+        Decode an image, returning a list of surfaces with the image fit into each of the given resolutions.
+        """
+
+        logger.info("Load: %s" % path)
+        imgobj = None
+        if turbo_jpeg and path.lower().endswith(('.jpg','.jpeg')):
+            oval = self.orientation(path)
+            target = self.decode_size(res_list, oval)
+            try:
+                imgobj = open_jpeg_turbo(path, target)
+            except Exception as err:
+                logger.debug("Failed to decode with turbojpeg, will use PIL: %s" % path)
+                logger.debug(err, exc_info=True)
+        if imgobj is None:
+            imgobj = Image.open(path)
+            oval = self.orientation(path, imgobj)
+            target = self.decode_size(res_list, oval)
+        with imgobj:
+            # let libjpeg scale down while decoding, then shrink the rest of the way (with a better filter than smoothscale)
+            imgobj.draft("RGB", target)
+            imgobj.thumbnail(target, Image.LANCZOS)
+            if oval == 6:
+                # rotate CW 90
+                imgobj = imgobj.transpose(Image.ROTATE_270)
+            elif oval == 8:
+                # rotate 90 CCW
+                imgobj = imgobj.transpose(Image.ROTATE_90)
+            elif oval == 3:
+                # rotate 180
+                imgobj = imgobj.transpose(Image.ROTATE_180)
+            srf = pygame.image.frombuffer(imgobj.tobytes(), imgobj.size, "RGB")    # shares the bytes rather than copying them
+        wid,hig = srf.get_size()
+
+        result_surfaces = []
+        for one_res in res_list:
+            # fit inside the resolution, leaving black bars top & bottom or left & right (or neither for a perfect fit)
+            ratio = min(one_res[0] / wid, one_res[1] / hig)
+            scale_res = (wid*ratio, hig*ratio)
+            paste_at = ((one_res[0]-scale_res[0])/2, (one_res[1]-scale_res[1])/2)
+            if abs(scale_res[0] - wid) <= 1 and abs(scale_res[1] - hig) <= 1:
+                srf2 = srf      # PIL already made it the right size (give or take rounding)
+            else:
+                srf2 = pygame.transform.smoothscale(srf,scale_res)
+            blksrf = pygame.Surface(one_res)
+            blksrf.blit(srf2,paste_at)
+            result_surfaces.append(blksrf)
+        return result_surfaces
+
+    def worker(self, path, resolutions):
+        """
+        Function to run in the worker pool.  Loads one image at the given resolution(s) and stores it in the cache.
+        """
+
+        if not self.running:
+            return
+        single_result = not self.multiple_resolutions(resolutions)
+        res_list = [resolutions] if single_result else resolutions
+        try:
+            result_surfaces = None
+            if self.disk_cache:
+                cache_paths = self.disk_cache_paths(path, res_list)
+                result_surfaces = self.read_disk_cache(cache_paths, res_list)
+                if result_surfaces:
+                    logger.debug("Loaded from the disk cache: %s" % path)
+            if not result_surfaces:
+                result_surfaces = self.load_surfaces(path, res_list)
+                if self.disk_cache:
+                    self.write_disk_cache(cache_paths, result_surfaces)
         except Exception as err:
-            logger.error("Error in background thread.")
+            logger.error("Error loading image: %s" % path)
             logger.error(err,exc_info=True)
+            result_surfaces = None
+
+        with self.image_cache_lock:
+            self.loading.discard(path)
+
+            # store the result, careful to protect against the list of paths or the output res having changed
+            if not self.running:
+                return
+            if result_surfaces is None:
+                self.failed.add(path)
+            elif resolutions != self.resolutions:
+                logger.info("Freshly-loaded image no longer has a valid resolution.")
+            elif path in self.path_to_idx:
+                idx = self.path_to_idx[path]
+                if single_result:
+                    self.cache(idx, result_surfaces[0])
+                else:
+                    self.cache(idx, tuple(result_surfaces))
+                logger.debug("Add loaded image idx %d to the cache." % idx)
+
+                # let the main thread know, in case its waiting
+                self.image_cache_lock.notify_all()
+            else:
+                logger.info("Freshly-loaded image no longer has a valid path.")
+
+            self.schedule()
 
     def get_surface(self, idx, delay=0.05):
         """
-        Attempt to return the image surface, return None after the given delay if not currently available.
+        Attempt to return the image surface, return None after the given delay if not currently available.  Makes the given index the current one.
         """
 
+        # workers never evict the current image (only set_paths and set_screen replace the cache, and they are called by us), so it can be read without the lock
+        if idx == self.current_idx:
+            surfaces = self.image_cache.get(idx)
+            if surfaces is not None:
+                return surfaces
+
         with self.image_cache_lock:
-            self.current_idx = idx
-            logger.debug("Set cache index to %d because of surface request." % self.current_idx)
-            if idx not in self.image_cache:
-                if not self.thread:
-                    # if the background thread stopped (due to caching everything) start it again
-                    self.thread = Thread(target=self.worker)
-                    self.thread.daemon = True
-                    self.thread.start()
-                if delay:
-                    self.image_cache_lock.wait(delay)
+            if idx != self.current_idx:
+                self.direction = 1 if idx > self.current_idx else -1
+                self.current_idx = idx
+                logger.debug("Set cache index to %d because of surface request." % self.current_idx)
+                self.schedule()
+            if idx not in self.image_cache and delay:
+                # other images arriving in the cache are no reason to wake up
+                self.image_cache_lock.wait_for(lambda: idx in self.image_cache, delay)
             return self.image_cache.get(idx)
 
+    def close(self):
+        """
+        Stop loading images, call before pygame.quit().  Loads that are already running finish, but their results are dropped.
+        """
+
+        with self.image_cache_lock:
+            self.running = False
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def load_failed(self, idx):
+        """
+        Return True if the image at the given index could not be loaded, it will not be tried again.
+        """
+
+        with self.image_cache_lock:
+            return 0 <= idx < len(self.paths) and self.paths[idx] in self.failed
+
     def set_screen(self, resolutions):
         """
         Throw out images that have been cached with the wrong resolution.
@@ -319,6 +656,8 @@ class ImageCache():
             # we need to hold the lock to coordinate with any image that may be in the loading process
             self.resolutions = resolutions
             self.image_cache.clear()
+            self.cached_idxs = []
+            self.schedule()
 
     def set_paths(self, paths):
         """
@@ -328,31 +667,34 @@ class ImageCache():
         logger.debug("Load new image list with %d items." % len(paths))
 
         with self.image_cache_lock:
+            if len(paths) >= len(self.paths) and paths[:len(self.paths)] == self.paths:
+                # only appended to, so the cached indexes are still valid
+                for i in range(len(self.paths), len(paths)):
+                    self.path_to_idx[paths[i]] = i
+                self.paths = paths
+                self.schedule()
+                return
+
             old_cache = self.image_cache
-            old_path_to_idx = self.path_to_idx
+            old_paths = self.paths
+            self.path_to_idx = dict((p,i) for i,p in enumerate(paths))
+            self.paths = paths
 
             # if our currently selected image continues to exist, use that index
             # otherwise, set our current image to the start of the new list
-            current_path = self.paths[self.current_idx]
-            if current_path in paths:
-                self.current_idx = paths.index(current_path)
-            else:
-                self.current_idx = 0
+            self.current_idx = self.path_to_idx.get(old_paths[self.current_idx], 0)
             logger.debug("Repoint cache index to %d while updating paths." % self.current_idx)
 
-            overlap = set(self.paths).intersection(set(paths))
-            logger.debug("There are %d images to carry over from the old cache." % len(overlap))
-
+            # reference the image data of cached images that are still in the list in the new dict()
             self.image_cache = dict()
-            self.path_to_idx = dict((p,i) for i,p in enumerate(paths))
-            self.paths = paths
+            self.cached_idxs = []
+            for old_idx,surfaces in old_cache.items():
+                new_idx = self.path_to_idx.get(old_paths[old_idx])
+                if new_idx != None:
+                    self.cache(new_idx, surfaces)
+            logger.debug("Carried over %d images from the old cache." % len(self.image_cache))
 
-            for path in overlap:
-                old_idx = old_path_to_idx[path]
-                new_idx = self.path_to_idx[path]
-                if old_idx in old_cache:
-                    # reference the image data in the new dict()
-                    self.image_cache[new_idx] = old_cache[old_idx]
+            self.schedule()
 
 
 
@@ -374,7 +716,7 @@ def apply_screen_setting(fullscreen):
         screen_res = desktops[0]
     else:
         logger.info("Windowed mode.")
-        screen_res = (1024,768)
+        screen_res = windowed_res
         more = {}
 
     pygame.display.set_mode(size=screen_res, **more)
@@ -385,12 +727,22 @@ def apply_screen_setting(fullscreen):
 
 
 
-def text_box(text, textcolor, backgroundcolor, size=28):
+@functools.lru_cache(maxsize=None)
+def get_font(size):
+    """
+    Return the default font at the given size, only loading it once.
+    """
+
+    return pygame.font.Font(pygame.font.get_default_font(), size)
+
+
+
+def text_box(text, textcolor, backgroundcolor, size=28, font=None):
     """
     Create a surface with text on it.
     """
 
-    font = pygame.font.Font(pygame.font.get_default_font(), size)
+    font = font or get_font(size)
     spacing = 4
     text_surface = font.render(text, True, textcolor, backgroundcolor)
     text_surface_2 = pygame.surface.Surface((text_surface.get_size()[0]+spacing*2,text_surface.get_size()[1]+spacing*2))
@@ -400,17 +752,25 @@ def text_box(text, textcolor, backgroundcolor, size=28):
 
 
 
-def start_show(image_info_list):
+@functools.lru_cache(maxsize=256)
+def date_box(date_text):
+    """
+    Create a surface with a date on it, each date is only rendered once.
+    """
+
+    return text_box(date_text, (255,255,255), (0,0,0))
+
+
+
+def start_show(image_index):
     logger.info("Start.")
 
-    paths,path_to_date = select_image_subset(image_info_list)
+    paths = select_image_subset(image_index)
 
-    pygame.init()
-    pygame.display.init()
+    # start loading images before the window is open, we know what size it will be
+    cache = ImageCache(windowed_res, paths, args.cache_count, workers=args.load_threads, disk_cache=args.disk_cache, disk_cache_limit=args.disk_cache_mbytes*1024*1024)
     screen_res, screen_srf = apply_screen_setting(False)
 
-    cache = ImageCache(screen_res, paths, args.cache_count)
-
     fullscreen = False
     stop = False
     new_idx_chosen = True
@@ -418,6 +778,7 @@ def start_show(image_info_list):
     start_at = 0
     direction = 1
     flip_time = 2
+    warned_failed = False
     while not stop:
         if new_idx_chosen or time() - start_at > flip_time:
             if not new_idx_chosen:
@@ -428,19 +789,36 @@ def start_show(image_info_list):
             if srf:
                 logger.info("Show image #%d of %d." % (idx+1,len(paths)))
                 screen_srf.blit(srf,(0,0))
-                txt_srf = text_box("%04d-%02d-%02d" % tuple(path_to_date[paths[idx]][0:3]), (255,255,255), (0,0,0))
+                txt_srf = date_box("%04d-%02d-%02d" % image_index.date_of(paths[idx])[0:3])
                 screen_srf.blit(txt_srf,(0,0))
                 txt_srf2 = text_box("%d of %d" % (idx+1,len(paths)), (150,150,220), (0,0,0), size=16)
                 screen_srf.blit(txt_srf2,(0,txt_srf.get_height()))
                 pygame.display.flip()
                 start_at = time()
                 new_idx_chosen = False
+            elif cache.load_failed(idx):
+                # skip it, in the direction we were going (turning around at the ends)
+                if not warned_failed:
+                    logger.warning("Could not load image #%d (%s), skipping it and any others that fail (--verify-paths checks the files before starting)." % (idx+1,paths[idx]))
+                    warned_failed = True
+                else:
+                    logger.debug("Skip image #%d of %d, it could not be loaded." % (idx+1,len(paths)))
+                step = cache.direction
+                if not 0 <= idx + step < len(paths):
+                    step = -step
+                if 0 <= idx + step < len(paths):
+                    idx += step
             else:
                 logger.debug("Image #%d of %d not available yet." % (idx+1,len(paths)))
+
+        if new_idx_chosen:
+            events = pygame.event.get()     # still waiting for the image, get_surface() has paused a little already
         else:
-            sleep(0.05)
+            # sleep until it is time for the next image, unless something happens first (a timeout of 0 would wait forever)
+            event = pygame.event.wait(max(1, int((start_at + flip_time - time()) * 1000)))
+            events = [] if event.type == pygame.NOEVENT else [event] + pygame.event.get()
 
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                stop = True
             elif event.type == pygame.KEYDOWN:
@@ -462,7 +840,7 @@ def start_show(image_info_list):
                     cache.set_screen(screen_res)
                 elif event.key == pygame.K_m:       # add more nearby images
                     logger.debug("Display idx before: %d (%s)" % (idx,paths[idx]))
-                    idx,paths = more_images(idx,paths,path_to_date,image_info_list)
+                    idx,paths = more_images(idx,paths,image_index)
                     logger.debug("Display idx after: %d (%s)" % (idx,paths[idx]))
                     cache.set_paths(paths)
                 elif event.key == pygame.K_SPACE:
@@ -472,6 +850,7 @@ def start_show(image_info_list):
         if idx < 0: idx = 0
         if idx >= len(paths): idx = len(paths)-1
 
+    cache.close()
     pygame.quit()
 
 
@@ -483,6 +862,10 @@ def main():
     # parse arguments
     parser = argparse.ArgumentParser(description='Make a semi-random slideshow from one or more inventory files.')
     parser.add_argument('--cache-count', metavar='NUM', type=int, help='how many images to load into RAM for rapid display (default: %(default)s)', default=100)
+    parser.add_argument('--load-threads', metavar='NUM', type=int, help='how many threads load and scale images in the background (default: the number of CPUs, at most 4)')
+    parser.add_argument('--verify-paths', help='check that all the image files in the inventories exist before starting', action="store_true")
+    parser.add_argument('--disk-cache', metavar='PATH', help='keep scaled images in the given directory (such as ~/.cache/slideshow) to speed up later shows, as raw pixels (several MB per image and screen size)')
+    parser.add_argument('--disk-cache-mbytes', metavar='NUM', type=int, help='the most space the disk cache may use, the least recently shown images are removed beyond this (default: %(default)s)', default=4096)
     parser.add_argument('--log', metavar='PATH', help='base log file name (default: %(default)s)', default="slideshow.log")
     parser.add_argument('inventory_files', metavar='FILE', nargs='+', help='one or more inventory files to show images from')
     args = parser.parse_args()
@@ -495,6 +878,19 @@ def main():
         logger.error("The program can not continue.")
         exit(-1)
 
+    if args.load_threads is not None and not 1 <= args.load_threads <= args.cache_count:
+        logger.error("The parameter --load-threads must be between 1 and --cache-count (%d)." % args.cache_count)
+        logger.error("The program can not continue.")
+        exit(-1)
+
+    if args.disk_cache_mbytes < 1:
+        logger.error("The parameter --disk-cache-mbytes cannot be less than 1.")
+        logger.error("The program can not continue.")
+        exit(-1)
+
+    if args.disk_cache:
+        args.disk_cache = os.path.expanduser(args.disk_cache)
+
     try:
         # on Windows, expand special characters (on Linux, would perhaps expand previously escaped characters)
         targets = []
@@ -514,14 +910,20 @@ def main():
                 logger.error("The program can not continue.")
                 exit(-1)
 
-        image_info_list = load_inventories(args.inventory_files)
+        # reading the inventories is mostly waiting on files, start SDL meanwhile (it prefers the main thread)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(load_inventories, args.inventory_files, verify_paths=args.verify_paths)
+            pygame.init()
+            pygame.display.init()
+            image_info_list = future.result()
 
         if not image_info_list:
             logger.error("The inventory files do not contain any images.")
             logger.error("The program can not continue.")
             exit(-1)
 
-        start_show(image_info_list)
+        image_index = ImageIndex(image_info_list)
+        start_show(image_index)
 
     except Exception as err:
         logger.error("Exception " + str(type(err)) + " while working.", exc_info=True)
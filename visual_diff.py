@@ -403,6 +403,8 @@ def start_show(image_info_list_1, image_info_list_2):
             new_idx_chosen = False
         elif remake_rows:
             logger.info("Remake image rows.")
+            upper_row.cache.close()
+            lower_row.cache.close()
             upper_row = ImageRow(image_info_list_1, all_images, checksum_to_idx, screen_srf, (0,0), row_dims, row_width, upper_row.all_image_idx)
             lower_row = ImageRow(image_info_list_2, all_images, checksum_to_idx, screen_srf, (0,screen_res[1]/2), row_dims, row_width, upper_row.all_image_idx)
             remake_rows = False
@@ -474,6 +476,8 @@ def start_show(image_info_list_1, image_info_list_2):
         if idx < 0: idx = 0
         if idx >= len(all_images): idx = len(all_images)-1
 
+    upper_row.cache.close()
+    lower_row.cache.close()
     pygame.quit()
 
 
@@ -485,6 +489,7 @@ def main():
     # parse arguments
     parser = argparse.ArgumentParser(description='Compare two inventory files (which may be single- or multi-directory) and show which images differ between them.')
     parser.add_argument('--cache-count', metavar='NUM', type=int, help='how many images to load into RAM for rapid display (default: %(default)s)', default=100)
+    parser.add_argument('--verify-paths', help='check that all the image files in the inventories exist before starting', action="store_true")
     parser.add_argument('--log', metavar='PATH', help='base log file name (default: %(default)s)', default="diff.log")
     parser.add_argument('inventory_file_1', metavar='FILE', help='an inventory file to show images from')
     parser.add_argument('inventory_file_2', metavar='FILE', help='an inventory file to show images from')
@@ -519,8 +524,8 @@ def main():
             logger.error("The program can not continue.")
             exit(-1)
 
-        image_info_list_1 = load_inventories([args.inventory_file_1], remove_dupes=False)
-        image_info_list_2 = load_inventories([args.inventory_file_2], remove_dupes=False)
+        image_info_list_1 = load_inventories([args.inventory_file_1], remove_dupes=False, verify_paths=args.verify_paths)
+        image_info_list_2 = load_inventories([args.inventory_file_2], remove_dupes=False, verify_paths=args.verify_paths)
 
         if not (image_info_list_1 and image_info_list_2):
             logger.error("One or both of the specified inventory files did not yield usable images.")